@@ -1,6 +1,6 @@
-from bs4 import BeautifulSoup
-import csv
+from bs4 import BeautifulSoup, NavigableString, Tag
 import re
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 CSS_COLOR_MAP = {
@@ -21,12 +21,45 @@ ALLOWED_TAGS = {
     "code", "pre", "span", "br",
     "ul", "ol", "li", "a", "div"
 }
+_ALLOWED = frozenset(ALLOWED_TAGS)
+
+_COLOR_CLASS_RE = re.compile(r"(?:highlight|block-color)-([a-z_]+)$")
+_FENCE_RE = re.compile(r"```(.*?)```", re.DOTALL)
+_TAG_SPLIT_RE = re.compile(r"[,;\n]+")
+_WS_RE = re.compile(r"\s+")
+_BR_RE = re.compile(r"<br\s*/?>")
+
+# Fields containing any of these must be quoted (csv.QUOTE_MINIMAL rules)
+_NEEDS_QUOTE = re.compile(r'[",\r\n]')
+
+# Rows per batched write to the output file
+_WRITE_CHUNK = 4096
+
+# Below this many rows the process pool costs more than it saves
+_PARALLEL_MIN_ROWS = 256
 
 
 def merge_style(el, new_rules: str) -> None:
     """Merge new inline CSS rules into an element's style attribute."""
-    existing = el.get("style", "").strip().rstrip(";")
-    el["style"] = (existing + ";" + new_rules) if existing else new_rules
+    attrs = el.attrs
+    existing = attrs.get("style")
+    # Fast path: most Notion spans carry no inline style at all
+    if existing is None:
+        attrs["style"] = new_rules
+        return
+
+    existing = existing.strip().rstrip(";")
+    attrs["style"] = (existing + ";" + new_rules) if existing else new_rules
+
+
+def _strip_bgcolor(style: str) -> str:
+    """Drop background-color rules from an inline style string."""
+    parts = []
+    for rule in style.split(";"):
+        rule = rule.strip()
+        if rule and not rule.startswith("background-color"):
+            parts.append(rule)
+    return ";".join(parts)
 
 
 def convert_color_classes_to_inline(el) -> None:
@@ -34,12 +67,22 @@ def convert_color_classes_to_inline(el) -> None:
     Convert Notion color classes like 'highlight-red' or 'block-color-blue'
     into inline style="color:...". Ignores background variants.
     """
-    classes = el.get("class", [])
+    attrs = el.attrs
+    classes = attrs.get("class")
     if not classes:
         return
 
+    # Local bindings: this runs for every span/mark in the export
+    match_color = _COLOR_CLASS_RE.match
+    color_for = CSS_COLOR_MAP.get
+
+    # Mutate the class list in place; it is the same object held by attrs
     for cls in list(classes):
-        m = re.match(r"(?:highlight|block-color)-([a-z_]+)$", cls)
+        # Cheap substring test first; most classes are not Notion colors
+        if "highlight-" not in cls and "block-color-" not in cls:
+            continue
+
+        m = match_color(cls)
         if not m:
             continue
 
@@ -47,16 +90,37 @@ def convert_color_classes_to_inline(el) -> None:
 
         # Only apply text color; ignore background suffix
         if not key.endswith("_background"):
-            col = CSS_COLOR_MAP.get(key)
+            col = color_for(key)
             if col:
                 merge_style(el, f"color:{col}")
 
         classes.remove(cls)
 
-    if classes:
-        el["class"] = classes
-    else:
-        el.attrs.pop("class", None)
+    if not classes:
+        attrs.pop("class", None)
+
+
+def _handle_mark(el) -> None:
+    """Replace <mark> with <span> to avoid default yellow background."""
+    el.name = "span"
+    convert_color_classes_to_inline(el)
+
+
+def _handle_a(el) -> None:
+    """Clean anchor tags: keep href only."""
+    attrs = el.attrs
+    href = attrs.get("href")
+    attrs.clear()
+    if href:
+        attrs["href"] = href
+
+
+# Per-tag cleanup applied during the sanitize walk
+_HANDLERS = {
+    "mark": _handle_mark,
+    "span": convert_color_classes_to_inline,
+    "a": _handle_a,
+}
 
 
 def sanitize_inline_html(cell, strip_all: bool = False) -> str:
@@ -68,68 +132,67 @@ def sanitize_inline_html(cell, strip_all: bool = False) -> str:
     """
     # Front side: plain text only
     if strip_all:
+        # Fast path for the common single-text-node cell (no markup)
+        children = cell.contents
+        if not children:
+            return ""
+        if len(children) == 1 and type(children[0]) is NavigableString:
+            return children[0].strip()
         return cell.get_text(" ", strip=True)
 
-    # Replace <mark> with <span> to avoid default yellow background
-    for mark in cell.find_all("mark"):
-        mark.name = "span"
-        convert_color_classes_to_inline(mark)
-
-    # Apply color conversions on spans
-    for el in cell.find_all("span"):
-        convert_color_classes_to_inline(el)
-
-    # Clean anchor tags: keep href only
-    for a in cell.find_all("a"):
-        href = a.get("href")
-        a.attrs = {"href": href} if href else {}
-
-    # Remove disallowed tags, but keep their content
-    for tag in list(cell.find_all(True)):
-        if tag.name not in ALLOWED_TAGS:
-            tag.unwrap()
-
-    # Strip any background-color from inline styles
-    for el in cell.find_all(True):
-        if "style" in el.attrs:
-            styles = [
-                s for s in el["style"].split(";")
-                if not s.strip().startswith("background-color")
-            ]
-            el["style"] = ";".join(s for s in styles if s.strip())
-
-    # Normalize <br> variants
-    html_str = (
-        cell.decode_contents()
-        .replace("<br>", "<br/>")
-        .replace("<br />", "<br/>")
-    )
+    # Hot-loop globals bound as locals
+    handler_for = _HANDLERS.get
+    allowed = _ALLOWED
+    strip_bgcolor = _strip_bgcolor
+
+    # Single lazy walk over the cell. Structural edits (unwrapping) are
+    # deferred so the tree is not mutated under the descendants generator.
+    to_unwrap = []
+    for el in cell.descendants:
+        if not isinstance(el, Tag):
+            continue
+
+        h = handler_for(el.name)
+        if h is not None:
+            h(el)
+
+        # Disallowed tags are removed after the walk, keeping their content
+        if el.name not in allowed:
+            to_unwrap.append(el)
+            continue
+
+        # Strip any background-color from inline styles
+        attrs = el.attrs
+        style = attrs.get("style")
+        if style is not None:
+            attrs["style"] = strip_bgcolor(style)
+
+    for el in to_unwrap:
+        el.unwrap()
 
-    # Temporarily treat <br/> as newline for easier code-fence parsing
-    tmp = html_str.replace("<br/>", "\n")
+    # Temporarily treat every <br> variant as newline for easier code-fence parsing
+    tmp = _BR_RE.sub("\n", cell.decode_contents())
 
-    # Convert ``` fenced blocks to monospace <div> with preserved colors
+    # Convert ``` fenced blocks to monospace <div> with preserved colors.
+    # Background colors were already stripped by the walk above.
     def fence_replacer(m: re.Match) -> str:
         inner = m.group(1)
-        inner_soup = BeautifulSoup(inner, "html.parser")
 
-        # Remove any background colors inside the fenced block
-        for el in inner_soup.find_all(True):
-            if "style" in el.attrs:
-                styles = [
-                    s for s in el["style"].split(";")
-                    if not s.strip().startswith("background-color")
-                ]
-                el["style"] = ";".join(s for s in styles if s.strip())
+        # A fence can cross tag boundaries (e.g. "<b>```x</b> y```"), so
+        # re-balance any markup inside it; plain-text fences skip the parse.
+        if "<" in inner:
+            inner = BeautifulSoup(inner, "html.parser").decode_contents()
 
         return (
             "<div style=\"font-family:Menlo,Consolas,'Courier New',monospace; "
             "white-space:pre\">"
-            + inner_soup.decode_contents()
+            + inner
             + "</div>"
         )
 
-    tmp = re.sub(r"```(.*?)```", fence_replacer, tmp, flags=re.DOTALL)
+    # Most cells have no fences; skip the regex engine entirely then
+    if "```" in tmp:
+        tmp = _FENCE_RE.sub(fence_replacer, tmp)
 
     # Convert remaining newlines back to <br/>
     tmp = tmp.replace("\n", "<br/>")
@@ -149,21 +212,66 @@ def tags_from_cell(cell) -> str:
     - Returns a space-separated string (Anki's tag format).
     """
     raw = cell.get_text(" ", strip=True)
-    tokens = [
-        t.strip() for t in re.split(r"[,;\n]+", raw)
-        if t.strip()
-    ]
+    # The split already consumes every comma/semicolon, so one strip suffices
+    tokens = (t.strip() for t in _TAG_SPLIT_RE.split(raw))
+    clean = (_WS_RE.sub("-", t) for t in tokens if t)
+
+    # dict.fromkeys keeps first-seen order while deduplicating
+    return " ".join(dict.fromkeys(clean))
+
+
+def _cell_soup(html: str):
+    """Parse a serialized <td> as a BeautifulSoup cell for the sanitize pass."""
+    return BeautifulSoup("<table><tr>" + html + "</tr></table>", "lxml").td
 
-    clean = []
-    seen = set()
 
-    for tok in tokens:
-        tok = re.sub(r"\s+", "-", tok.strip()).strip(",;")
-        if tok and tok not in seen:
-            clean.append(tok)
-            seen.add(tok)
+def _convert_cells(cells: tuple) -> tuple:
+    """Turn one row of (notion_id, front, back, tags) cells into CSV fields."""
+    notion_id, front_td, back_td, tags_td = cells
+    front_plain = sanitize_inline_html(front_td, strip_all=True)
+    back_html = sanitize_inline_html(back_td, strip_all=False)
+    tags = tags_from_cell(tags_td) if tags_td is not None else ""
+    return notion_id, front_plain, back_html, tags
 
-    return " ".join(clean)
+
+def _sanitize_row(row: tuple) -> tuple:
+    """
+    Worker-process variant of _convert_cells. DOM nodes are not picklable,
+    so the cells arrive as serialized <td> HTML and are re-parsed here.
+    """
+    notion_id, front_html, back_html, tags_html = row
+    return _convert_cells(
+        (
+            notion_id,
+            _cell_soup(front_html),
+            _cell_soup(back_html),
+            _cell_soup(tags_html) if tags_html is not None else None,
+        )
+    )
+
+
+def _csv_field(field: str) -> str:
+    """Quote a CSV field only if it needs it, as csv.QUOTE_MINIMAL does."""
+    if _NEEDS_QUOTE.search(field) is None:
+        return field
+    return '"' + field.replace('"', '""') + '"'
+
+
+def _csv_line(row: tuple) -> bytes:
+    """Format one row as a UTF-8 encoded, CRLF-terminated CSV line."""
+    return (",".join(map(_csv_field, row)) + "\r\n").encode("utf-8")
+
+
+def _write_rows(f, rows) -> None:
+    """Write CSV rows to a binary file in batches of _WRITE_CHUNK lines."""
+    chunk = []
+    for row in rows:
+        chunk.append(_csv_line(row))
+        if len(chunk) >= _WRITE_CHUNK:
+            f.write(b"".join(chunk))
+            chunk.clear()
+    if chunk:
+        f.write(b"".join(chunk))
 
 
 def parse_table(soup: BeautifulSoup):
@@ -200,7 +308,66 @@ def parse_table(soup: BeautifulSoup):
     return table, col_map
 
 
-def convert_file(input_path: str | Path, output_path: str | Path) -> None:
+def _row_cells(tr, last_col: int) -> list:
+    """Collect the direct <td> children of a row up to column index last_col."""
+    tds = []
+    for td in tr.children:
+        if td.name == "td":
+            tds.append(td)
+            if len(tds) > last_col:
+                break
+    return tds
+
+
+def _iter_row_cells(tbody, col_map: dict):
+    """Yield (notion_id, front, back, tags) cells for each row of the table."""
+    last_col = max(col_map.values())
+    has_tags = "tags" in col_map
+
+    for tr in tbody.children:
+        if tr.name != "tr":
+            continue
+
+        tds = _row_cells(tr, last_col)
+        if not tds:
+            continue
+
+        yield (
+            tds[col_map["id"]].get_text(strip=True),
+            tds[col_map["front"]],
+            tds[col_map["back"]],
+            tds[col_map["tags"]] if has_tags else None,
+        )
+
+
+def _convert_rows(tbody, col_map: dict, workers: int | None):
+    """
+    Yield converted CSV rows in table order. Rows are streamed one at a time
+    unless a process pool is requested and the table is large enough.
+    """
+    rows = _iter_row_cells(tbody, col_map)
+    if workers is None or workers <= 1:
+        yield from map(_convert_cells, rows)
+        return
+
+    rows = list(rows)
+    if len(rows) < _PARALLEL_MIN_ROWS:
+        yield from map(_convert_cells, rows)
+        return
+
+    cell_rows = [
+        (nid, str(front), str(back), str(tags) if tags is not None else None)
+        for nid, front, back, tags in rows
+    ]
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        yield from ex.map(_sanitize_row, cell_rows, chunksize=64)
+
+
+def convert_file(
+    input_path: str | Path,
+    output_path: str | Path,
+    workers: int | None = None,
+) -> None:
     """
     Main conversion entry point.
 
@@ -209,42 +376,35 @@ def convert_file(input_path: str | Path, output_path: str | Path) -> None:
     - Front (plain text)
     - Back (cleaned HTML)
     - Tags (normalized)
+
+    Rows are converted serially by default. Pass workers > 1 to sanitize
+    large exports in a process pool; the calling script must then guard
+    its entry point with `if __name__ == "__main__":` on platforms that
+    spawn worker processes (macOS, Windows, and Linux from Python 3.14).
     """
     input_path = Path(input_path)
     output_path = Path(output_path)
 
-    html = input_path.read_text(encoding="utf-8", errors="ignore")
-    soup = BeautifulSoup(html, "html.parser")
+    # Hand raw bytes to lxml so it decodes (and sniffs the charset) in C
+    html_bytes = input_path.read_bytes()
+    soup = BeautifulSoup(html_bytes, "lxml")
 
     table, col_map = parse_table(soup)
-    rows_out = []
 
     tbody = table.find("tbody")
     if tbody is None:
         raise RuntimeError("Could not find <tbody> in HTML table.")
 
-    for tr in tbody.find_all("tr"):
-        tds = tr.find_all("td")
-        if not tds:
-            continue
-
-        notion_id = tds[col_map["id"]].get_text(strip=True)
-        front_plain = sanitize_inline_html(tds[col_map["front"]], strip_all=True)
-        back_html = sanitize_inline_html(tds[col_map["back"]], strip_all=False)
-        tags = tags_from_cell(tds[col_map["tags"]]) if "tags" in col_map else ""
-
-        rows_out.append(
-            {
-                "Notion-ID": notion_id,
-                "Front": front_plain,
-                "Back": back_html,
-                "Tags": tags,
-            }
-        )
-
-    with output_path.open("w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(
-            f, fieldnames=["Notion-ID", "Front", "Back", "Tags"]
-        )
-        writer.writeheader()
-        writer.writerows(rows_out)
+    # Write to a sibling file and move it into place only on success, so a
+    # failed conversion never leaves a partial CSV behind.
+    part_path = output_path.with_name(output_path.name + ".part")
+    try:
+        # Rows are formatted by hand and written as bytes through a large
+        # buffer, bypassing the csv module and the text-mode codec layer.
+        with part_path.open("wb", buffering=1 << 20) as f:
+            f.write(_csv_line(("Notion-ID", "Front", "Back", "Tags")))
+            _write_rows(f, _convert_rows(tbody, col_map, workers))
+        part_path.replace(output_path)
+    except BaseException:
+        part_path.unlink(missing_ok=True)
+        raise
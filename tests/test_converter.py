@@ -1,5 +1,12 @@
+import csv
+import io
 from pathlib import Path
-from notion2anki.converter import convert_file
+
+import pytest
+from bs4 import BeautifulSoup
+
+from notion2anki import converter
+from notion2anki.converter import convert_file, merge_style, sanitize_inline_html
 
 
 def test_convert_file_smoke(tmp_path: Path):
@@ -42,3 +49,147 @@ def test_convert_file_smoke(tmp_path: Path):
     assert "123" in text
     assert "What is OSPF?" in text
     assert "OSPF-LSA" in text or "OSPF-LSA Routing" in text
+
+
+BARE_TABLE = (
+    "<table>"
+    "<thead><tr><th>Notion-ID</th><th>Front</th><th>Back</th></tr></thead>"
+    "<tbody><tr><td>1</td><td>Q</td><td>A</td></tr></tbody>"
+    "</table>"
+)
+
+
+def test_convert_file_bare_table(tmp_path: Path):
+    # Exports without an <html>/<body> wrapper, with or without a BOM
+    for name, data in [
+        ("bare.html", BARE_TABLE.encode("utf-8")),
+        ("bom.html", b"\xef\xbb\xbf" + BARE_TABLE.encode("utf-8")),
+    ]:
+        html_path = tmp_path / name
+        html_path.write_bytes(data)
+
+        out_csv = tmp_path / (name + ".csv")
+        convert_file(html_path, out_csv)
+
+        assert out_csv.read_text(encoding="utf-8").splitlines() == [
+            "Notion-ID,Front,Back,Tags",
+            "1,Q,A,",
+        ]
+
+
+def test_convert_file_empty_input(tmp_path: Path):
+    html_path = tmp_path / "empty.html"
+    html_path.write_bytes(b"")
+
+    with pytest.raises(RuntimeError):
+        convert_file(html_path, tmp_path / "out.csv")
+
+
+def _table_html(rows: str) -> str:
+    return (
+        "<html><body><table>"
+        "<thead><tr><th>Notion-ID</th><th>Front</th><th>Back</th><th>Tags</th></tr></thead>"
+        "<tbody>" + rows + "</tbody>"
+        "</table></body></html>"
+    )
+
+
+def test_convert_file_process_pool_matches_serial(tmp_path: Path):
+    rows = "".join(
+        f"<tr><td>{i}</td><td>Q{i}</td>"
+        f"<td><mark class=\"highlight-red\">A{i}</mark><br>```x```</td>"
+        f"<td>t{i % 7}, shared tag</td></tr>"
+        for i in range(converter._PARALLEL_MIN_ROWS + 10)
+    )
+    html_path = tmp_path / "big.html"
+    html_path.write_text(_table_html(rows), encoding="utf-8")
+
+    serial_csv = tmp_path / "serial.csv"
+    pooled_csv = tmp_path / "pooled.csv"
+    convert_file(html_path, serial_csv)
+    convert_file(html_path, pooled_csv, workers=2)
+
+    assert pooled_csv.read_bytes() == serial_csv.read_bytes()
+
+
+def test_convert_file_failure_keeps_existing_output(tmp_path: Path, monkeypatch):
+    html_path = tmp_path / "sample.html"
+    html_path.write_text(
+        _table_html("<tr><td>1</td><td>Q</td><td>A</td><td></td></tr>"),
+        encoding="utf-8",
+    )
+    out_csv = tmp_path / "out.csv"
+    out_csv.write_text("previous", encoding="utf-8")
+
+    def boom(*args, **kwargs):
+        raise ValueError("boom")
+
+    monkeypatch.setattr(converter, "sanitize_inline_html", boom)
+    with pytest.raises(ValueError):
+        convert_file(html_path, out_csv)
+
+    assert out_csv.read_text(encoding="utf-8") == "previous"
+    assert sorted(tmp_path.iterdir()) == sorted([html_path, out_csv])
+
+
+def test_convert_file_nested_table_does_not_shift_columns(tmp_path: Path):
+    html_path = tmp_path / "nested.html"
+    html_path.write_text(
+        _table_html(
+            "<tr><td>1</td><td>Q</td>"
+            "<td><table><tr><td>n</td></tr></table></td>"
+            "<td>real</td></tr>"
+        ),
+        encoding="utf-8",
+    )
+
+    out_csv = tmp_path / "out.csv"
+    convert_file(html_path, out_csv)
+
+    assert out_csv.read_text(encoding="utf-8").splitlines()[1] == "1,Q,n,real"
+
+
+def _cell(html: str):
+    return BeautifulSoup("<table><tr><td>" + html + "</td></tr></table>", "lxml").td
+
+
+def test_sanitize_strips_background_and_trims_style_rules():
+    cell = _cell(
+        '<span style="background-color:yellow; font-weight:bold ;  color:red">x</span>'
+    )
+    assert sanitize_inline_html(cell) == '<span style="font-weight:bold;color:red">x</span>'
+
+
+def test_csv_line_matches_csv_writer():
+    samples = [
+        ("", "plain", "a,b", 'say "hi"'),
+        ("1", "line\nbreak", "cr\rhere", "crlf\r\n"),
+        ("x", " spaced ", "semi;colon", "café"),
+    ]
+    for row in samples:
+        buf = io.StringIO(newline="")
+        csv.writer(buf).writerow(row)
+        assert converter._csv_line(row) == buf.getvalue().encode("utf-8")
+
+
+def test_merge_style_normalizes_existing_rules():
+    for existing, expected in [
+        (None, "color:blue"),
+        ("", "color:blue"),
+        ("  ", "color:blue"),
+        ("color:red ", "color:red;color:blue"),
+        ("color:red; ", "color:red;color:blue"),
+    ]:
+        el = _cell("<span>x</span>").span
+        if existing is not None:
+            el["style"] = existing
+        merge_style(el, "color:blue")
+        assert el["style"] == expected
+
+
+def test_fence_crossing_tag_boundary_is_rebalanced():
+    cell = _cell("<b>```x</b> y```")
+    assert sanitize_inline_html(cell) == (
+        "<b><div style=\"font-family:Menlo,Consolas,'Courier New',monospace; "
+        "white-space:pre\">x y</div>"
+    )